@@ -3,23 +3,74 @@ AutoBudget AI - ML Service
 FastAPI application for machine learning predictions and analytics
 """
 
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+import anyio.to_thread
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, field_validator, model_validator
+from typing import List, Dict, Any, Literal, Optional, Set, Union
 import numpy as np
-import pandas as pd
-from datetime import datetime, timedelta
+from numba import njit
+from datetime import date as calendar_date, datetime, timedelta
+import hashlib
 import logging
+import os
+from statistics import fmean
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def _available_cpus() -> int:
+    """CPUs this process may actually use: cgroup quota, then affinity, then host count"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, -(-int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+CPUS = _available_cpus()
+
+# Uvicorn worker processes, one per usable CPU by default
+WORKERS = int(os.getenv("WEB_CONCURRENCY", CPUS))
+
+# Worker threads per process for CPU-bound model computations; the processes
+# already cover the cores, so each only needs its share (at least two)
+THREAD_LIMIT = int(os.getenv("ML_THREAD_LIMIT", max(2, CPUS // WORKERS)))
+
+# Most anomaly payloads coalesced into one NumPy pass
+BATCH_MAX_REQUESTS = 32
+
+# Below this many transactions plain Python beats NumPy's per-call overhead
+SMALL_PAYLOAD_THRESHOLD = 64
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Cap the offload thread pool on startup, stop the anomaly batcher on shutdown"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_LIMIT
+    yield
+    await anomaly_batcher.close()
+
+
 app = FastAPI(
     title="AutoBudget AI - ML Service",
     description="Machine learning service for predictive analytics",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    # orjson serializes the NumPy floats handlers return without float() casts
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -31,17 +82,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Same shapes datetime.fromisoformat accepts, so anomaly output never fails to parse
+ISO_DATE_PATTERN = (
+    r"^\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])"
+    r"([T ]([01]\d|2[0-3]):[0-5]\d(:[0-5]\d(\.\d{1,6})?)?(Z|[+-]([01]\d|2[0-3]):[0-5]\d)?)?$"
+)
+
 # Request/Response models
 class Transaction(BaseModel):
     """Transaction data model"""
+    # Read-only records; handlers only ever read attributes off them
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     amount: float
-    date: str
+    # ISO 8601 date with optional time; handlers bucket on the "YYYY-MM" prefix
+    date: str = Field(pattern=ISO_DATE_PATTERN)
     category: str
-    type: str  # income or expense
+    type: Literal['income', 'expense']
+    
+    @field_validator('date')
+    @classmethod
+    def check_calendar_date(cls, value: str) -> str:
+        """Reject days the pattern admits but the calendar does not (e.g. 02-30)"""
+        calendar_date.fromisoformat(value[:10])
+        return value
 
 class TransactionData(BaseModel):
     """Request model for transaction data"""
     transactions: List[Transaction]
+    
+    _expenses: List[Transaction] = PrivateAttr(default_factory=list)
+    _incomes: List[Transaction] = PrivateAttr(default_factory=list)
+    
+    @model_validator(mode='after')
+    def split_by_type(self) -> 'TransactionData':
+        """Partition transactions into expenses and incomes once at parse time"""
+        for t in self.transactions:
+            (self._expenses if t.type == 'expense' else self._incomes).append(t)
+        return self
+    
+    @property
+    def expenses(self) -> List[Transaction]:
+        """Expense transactions, in request order"""
+        return self._expenses
+    
+    @property
+    def incomes(self) -> List[Transaction]:
+        """Income transactions, in request order"""
+        return self._incomes
 
 class PredictionResponse(BaseModel):
     """Response model for predictions"""
@@ -62,6 +150,133 @@ class ForecastResponse(BaseModel):
     message: str
 
 
+def _month_key(date: str) -> int:
+    """Map an ISO date string to a monotone month bucket (year * 12 + month - 1)"""
+    # Only the leading "YYYY-MM" matters, so skip full datetime parsing
+    return int(date[:4]) * 12 + int(date[5:7]) - 1
+
+
+def _format_month(month_key: int) -> str:
+    """Render a month bucket back to its 'YYYY-MM' form"""
+    return f"{month_key // 12:04d}-{month_key % 12 + 1:02d}"
+
+
+def _monthly_totals(months: np.ndarray, amounts: np.ndarray):
+    """Sum amounts per month bucket in month order, skipping empty months"""
+    # Month keys span a small dense range, so bucket by offset instead of sorting
+    first = int(months.min())
+    offsets = months - first
+    counts = np.bincount(offsets)
+    totals = np.bincount(offsets, weights=amounts)
+    present = np.flatnonzero(counts)
+    return present + first, totals[present]
+
+
+def _monthly_series(transactions: List[Transaction]):
+    """Month keys and per-month totals as plain lists, in month order"""
+    if len(transactions) < SMALL_PAYLOAD_THRESHOLD:
+        by_month: Dict[int, float] = defaultdict(float)
+        for t in transactions:
+            by_month[_month_key(t.date)] += t.amount
+        month_keys = sorted(by_month)
+        return month_keys, [by_month[k] for k in month_keys]
+    
+    amounts, months, _, _ = _prepare_arrays(transactions, with_categories=False)
+    month_keys, totals = _monthly_totals(months, amounts)
+    return month_keys.tolist(), totals.tolist()
+
+
+def _intern_categories(transactions: List[Transaction]):
+    """Map category names to int32 codes, preserving first-seen order"""
+    lookup: Dict[str, int] = {}
+    codes = np.fromiter(
+        (lookup.setdefault(t.category, len(lookup)) for t in transactions),
+        dtype=np.int32,
+        count=len(transactions)
+    )
+    return codes, list(lookup)
+
+
+def _prepare_arrays(
+    transactions: List[Transaction],
+    dtype=np.float64,
+    with_months: bool = True,
+    with_categories: bool = True
+):
+    """
+    Build the parallel arrays every endpoint's NumPy path works from
+    Returns (amounts, month_keys, category_codes, category_names); the
+    month and category parts are None when not requested
+    """
+    n = len(transactions)
+    amounts = np.fromiter((t.amount for t in transactions), dtype=dtype, count=n)
+    months = None
+    if with_months:
+        months = np.fromiter((_month_key(t.date) for t in transactions), dtype=np.int32, count=n)
+    codes, category_names = None, None
+    if with_categories:
+        codes, category_names = _intern_categories(transactions)
+    return amounts, months, codes, category_names
+
+
+def _category_moments(codes: np.ndarray, amounts: np.ndarray, n_categories: int):
+    """Per-category count, mean and population std as arrays indexed by code"""
+    # bincount reduces each code's segment without the argsort a reduceat would need
+    # Accumulate in float64 even when the amounts are stored narrower
+    values = amounts.astype(np.float64, copy=False)
+    counts = np.bincount(codes, minlength=n_categories)
+    sums = np.bincount(codes, weights=values, minlength=n_categories)
+    sumsq = np.bincount(codes, weights=values * values, minlength=n_categories)
+    mean = sums / counts
+    mean_sq = sumsq / counts
+    var = mean_sq - mean ** 2
+    # Treat cancellation noise from E[x^2] - E[x]^2 as zero variance
+    var[var <= 1e-12 * mean_sq] = 0.0
+    return counts, mean, np.sqrt(var)
+
+
+@njit(cache=True, fastmath=True)
+def _flag_anomalies(amounts, codes, means, stds, scored, threshold):
+    """
+    Fused z-score + threshold pass over every row
+    Returns the flagged row indices and their z-scores, without
+    materializing a z-score for rows that are not flagged
+    """
+    n = amounts.shape[0]
+    flagged_idx = np.empty(n, dtype=np.int64)
+    flagged_z = np.empty(n, dtype=amounts.dtype)
+    count = 0
+    for i in range(n):
+        code = codes[i]
+        if scored[code]:
+            z_score = abs((amounts[i] - means[code]) / stds[code])
+            if z_score > threshold:
+                flagged_idx[count] = i
+                flagged_z[count] = z_score
+                count += 1
+    return flagged_idx[:count], flagged_z[:count]
+
+
+# Compile for the dtypes the anomaly pass uses so no request pays the JIT cost
+_flag_anomalies(
+    np.zeros(1, dtype=np.float32),
+    np.zeros(1, dtype=np.int32),
+    np.zeros(1, dtype=np.float32),
+    np.ones(1, dtype=np.float32),
+    np.zeros(1, dtype=np.bool_),
+    2.0
+)
+
+
+def _to_response(result: BaseModel) -> ORJSONResponse:
+    """
+    Serialize a response model straight to JSON
+    Returning a Response keeps response_model for the OpenAPI schema while
+    skipping FastAPI's second validation pass over the nested payload
+    """
+    return ORJSONResponse(content=result.model_dump(exclude_unset=True))
+
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -77,6 +292,45 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 
+def _compute_spending_model(expenses: List[Transaction]) -> PredictionResponse:
+    """Compute spending model statistics from expense transactions"""
+    # Not memoized: hashing the history costs as much as the single pass below
+    n = len(expenses)
+    
+    if n < 3:
+        return PredictionResponse(
+            predictions=[],
+            message="Insufficient data for training. Need at least 3 transactions."
+        )
+    
+    # Simple moving average prediction
+    _, monthly_spending = _monthly_series(expenses)
+    
+    if len(monthly_spending) < 2:
+        return PredictionResponse(
+            predictions=[],
+            message="Need at least 2 months of data for training"
+        )
+    
+    # Calculate average and trend
+    avg_spending = fmean(monthly_spending)
+    recent_trend = fmean(monthly_spending[-3:])
+    
+    predictions = [{
+        "average_monthly_spending": avg_spending,
+        "recent_trend": recent_trend,
+        "prediction_confidence": 0.75
+    }]
+    
+    logger.info(f"Model trained with {n} transactions")
+    
+    return PredictionResponse(
+        predictions=predictions,
+        model_accuracy=0.75,
+        message="Model trained successfully"
+    )
+
+
 @app.post("/api/ml/train-spending-model", response_model=PredictionResponse)
 async def train_spending_model(data: TransactionData):
     """
@@ -87,50 +341,71 @@ async def train_spending_model(data: TransactionData):
         if not data.transactions:
             raise HTTPException(status_code=400, detail="No transaction data provided")
         
-        # Convert to DataFrame
-        df = pd.DataFrame([t.dict() for t in data.transactions])
-        df['date'] = pd.to_datetime(df['date'])
-        df = df[df['type'] == 'expense'].sort_values('date')
-        
-        if len(df) < 3:
-            return PredictionResponse(
-                predictions=[],
-                message="Insufficient data for training. Need at least 3 transactions."
-            )
-        
-        # Simple moving average prediction
-        df['month'] = df['date'].dt.to_period('M')
-        monthly_spending = df.groupby('month')['amount'].sum().reset_index()
-        
-        if len(monthly_spending) < 2:
-            return PredictionResponse(
-                predictions=[],
-                message="Need at least 2 months of data for training"
-            )
-        
-        # Calculate average and trend
-        avg_spending = monthly_spending['amount'].mean()
-        recent_trend = monthly_spending['amount'].tail(3).mean()
-        
-        predictions = [{
-            "average_monthly_spending": float(avg_spending),
-            "recent_trend": float(recent_trend),
-            "prediction_confidence": 0.75
-        }]
-        
-        logger.info(f"Model trained with {len(df)} transactions")
-        
-        return PredictionResponse(
-            predictions=predictions,
-            model_accuracy=0.75,
-            message="Model trained successfully"
-        )
+        result = await anyio.to_thread.run_sync(_compute_spending_model, data.expenses)
+        return _to_response(result)
         
     except Exception as e:
         logger.error(f"Error training model: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _compute_expense_predictions(expenses: List[Transaction]) -> PredictionResponse:
+    """Compute 3-month expense predictions from expense transactions"""
+    n = len(expenses)
+    
+    if n < 3:
+        return PredictionResponse(
+            predictions=[],
+            message="Insufficient data for predictions. Need at least 3 transactions."
+        )
+    
+    # Calculate average per category
+    if n < SMALL_PAYLOAD_THRESHOLD:
+        sums: Dict[str, float] = defaultdict(float)
+        counts: Dict[str, int] = defaultdict(int)
+        for t in expenses:
+            sums[t.category] += t.amount
+            counts[t.category] += 1
+        category_names = list(sums)
+        category_avg = np.array([sums[c] / counts[c] for c in category_names])
+        last_month = max(_month_key(t.date) for t in expenses)
+    else:
+        amounts, months, codes, category_names = _prepare_arrays(expenses)
+        category_avg = np.bincount(codes, weights=amounts) / np.bincount(codes)
+        last_month = int(months.max())
+    
+    # Seed the +/-10% jitter from the per-category averages (an O(K) digest)
+    # so the same history always yields the same predictions
+    digest = hashlib.blake2b(category_avg.tobytes(), digest_size=16)
+    digest.update("\0".join(category_names).encode())
+    digest.update(last_month.to_bytes(4, "little", signed=True))
+    rng = np.random.default_rng(int.from_bytes(digest.digest(), "little"))
+    noise = rng.normal(0, 0.1, size=(3, len(category_names)))
+    predicted = category_avg[None, :] * (1.0 + noise)
+    
+    # Round every cell and total in C, handing back native Python floats
+    rounded = np.round(predicted, 2).tolist()
+    totals = np.round(predicted.sum(axis=1), 2).tolist()
+    
+    # Generate predictions for next 3 months
+    predictions = []
+    
+    for i in range(3):
+        predictions.append({
+            "month": _format_month(last_month + i + 1),
+            "total_predicted_expenses": totals[i],
+            "by_category": dict(zip(category_names, rounded[i]))
+        })
+    
+    logger.info(f"Generated predictions for {len(predictions)} months")
+    
+    return PredictionResponse(
+        predictions=predictions,
+        model_accuracy=0.80,
+        message="Predictions generated successfully"
+    )
+
+
 @app.post("/api/ml/predict-expenses", response_model=PredictionResponse)
 async def predict_expenses(data: TransactionData):
     """
@@ -141,55 +416,236 @@ async def predict_expenses(data: TransactionData):
         if not data.transactions:
             raise HTTPException(status_code=400, detail="No transaction data provided")
         
-        # Convert to DataFrame
-        df = pd.DataFrame([t.dict() for t in data.transactions])
-        df['date'] = pd.to_datetime(df['date'])
-        df = df[df['type'] == 'expense'].sort_values('date')
+        result = await anyio.to_thread.run_sync(_compute_expense_predictions, data.expenses)
+        return _to_response(result)
         
-        if len(df) < 3:
-            return PredictionResponse(
-                predictions=[],
-                message="Insufficient data for predictions. Need at least 3 transactions."
+    except Exception as e:
+        logger.error(f"Error predicting expenses: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _anomaly_record(transaction: Transaction, z_score: float, mean: float, std: float) -> Dict[str, Any]:
+    """Response entry for a transaction flagged as anomalous"""
+    # The batched path hands in np.float32 scores; always emit a Python float
+    z_score = float(z_score)
+    return {
+        "date": datetime.fromisoformat(transaction.date).isoformat(),
+        "amount": transaction.amount,
+        "category": transaction.category,
+        "z_score": z_score,
+        "expected_range": {
+            "min": mean - 2 * std,
+            "max": mean + 2 * std
+        },
+        "severity": "high" if z_score > 3 else "medium"
+    }
+
+
+def _anomaly_response(anomalies: List[Dict[str, Any]]) -> AnomalyResponse:
+    """Wrap flagged transactions in the endpoint's response model"""
+    return AnomalyResponse(
+        anomalies=anomalies,
+        total_anomalies=len(anomalies),
+        message=f"Detected {len(anomalies)} anomalous transactions"
+    )
+
+
+def _detect_anomalies_small(expenses: List[Transaction]) -> List[Dict[str, Any]]:
+    """Pure-Python z-score anomalies for payloads too small to amortize NumPy"""
+    by_category: Dict[str, List[float]] = defaultdict(list)
+    for t in expenses:
+        by_category[t.category].append(t.amount)
+    
+    # Categories need at least 3 transactions and some spread to be scored
+    moments = {}
+    for category, values in by_category.items():
+        if len(values) < 3:
+            continue
+        mean = sum(values) / len(values)
+        mean_sq = sum(v * v for v in values) / len(values)
+        var = mean_sq - mean * mean
+        if var > 1e-12 * mean_sq:
+            moments[category] = (mean, var ** 0.5)
+    
+    anomalies = []
+    for t in expenses:
+        if t.category not in moments:
+            continue
+        mean, std = moments[t.category]
+        z_score = abs(t.amount - mean) / std
+        if z_score > 2:
+            anomalies.append(_anomaly_record(t, z_score, mean, std))
+    
+    # Report grouped by category (first-seen order), then by date
+    rank = {category: r for r, category in enumerate(by_category)}
+    anomalies.sort(key=lambda a: (rank[a["category"]], a["date"]))
+    return anomalies
+
+
+def _compute_anomalies_batch(
+    payloads: List[List[Transaction]]
+) -> List[Union[AnomalyResponse, Exception]]:
+    """
+    Compute per-category z-score anomalies for several expense lists in one pass
+    Only payloads of at least SMALL_PAYLOAD_THRESHOLD rows are batched here;
+    failures are isolated per payload: each slot holds either that payload's
+    response or the exception it raised, so one bad payload cannot fail the rest
+    """
+    results: List[Union[AnomalyResponse, Exception, None]] = [None] * len(payloads)
+    
+    # Build one set of parallel arrays, offsetting each payload's category codes
+    batch_expenses: List[Transaction] = []
+    batch_amounts = []
+    batch_codes = []
+    batch_names: List[str] = []
+    batch_members = []
+    edges = [0]
+    
+    for i, expenses in enumerate(payloads):
+        # float32 halves the bytes streamed through the per-row z-score pass;
+        # responses still report each transaction's original amount. Unlike the
+        # float64 small-payload path, z-scores and the >2 / >3 cut-offs here are
+        # float32, so a score within ~1e-6 of a cut-off may land on either side
+        try:
+            amounts, _, codes, category_names = _prepare_arrays(
+                expenses, dtype=np.float32, with_months=False
             )
-        
-        # Group by month and category
-        df['month'] = df['date'].dt.to_period('M')
-        monthly_by_category = df.groupby(['month', 'category'])['amount'].sum().reset_index()
-        
-        # Calculate average per category
-        category_avg = df.groupby('category')['amount'].mean()
-        
-        # Generate predictions for next 3 months
-        predictions = []
-        last_month = df['month'].max()
-        
-        for i in range(1, 4):
-            next_month = last_month + i
-            month_predictions = {}
-            total = 0
+        except Exception as e:
+            results[i] = e
+            continue
+        batch_amounts.append(amounts)
+        batch_codes.append(codes + len(batch_names))
+        batch_names.extend(category_names)
+        batch_expenses.extend(expenses)
+        batch_members.append(i)
+        edges.append(len(batch_expenses))
+    
+    if batch_members:
+        try:
+            amounts = np.concatenate(batch_amounts)
+            codes = np.concatenate(batch_codes)
             
-            for category, avg_amount in category_avg.items():
-                predicted_amount = float(avg_amount * (1 + np.random.normal(0, 0.1)))
-                month_predictions[category] = predicted_amount
-                total += predicted_amount
+            # Per-category moments in one segmented pass over the amounts
+            counts, mean, std = _category_moments(codes, amounts, len(batch_names))
             
-            predictions.append({
-                "month": str(next_month),
-                "total_predicted_expenses": round(total, 2),
-                "by_category": {k: round(v, 2) for k, v in month_predictions.items()}
-            })
-        
-        logger.info(f"Generated predictions for {len(predictions)} months")
-        
-        return PredictionResponse(
-            predictions=predictions,
-            model_accuracy=0.80,
-            message="Predictions generated successfully"
-        )
+            # Categories need at least 3 transactions and some spread to be scored
+            scored = (counts >= 3) & (std > 0)
+            mean32 = mean.astype(np.float32)
+            safe_std32 = np.where(scored, std, 1.0).astype(np.float32)
+            
+            # Z-score threshold of 2 (2 standard deviations)
+            anomaly_idx, z_scores = _flag_anomalies(amounts, codes, mean32, safe_std32, scored, 2.0)
+            
+            # Fan the flagged rows back out to the payload they came from
+            bounds = np.searchsorted(anomaly_idx, edges)
+        except Exception as e:
+            # The shared pass covers every batched payload, so all of them fail
+            for i in batch_members:
+                results[i] = e
+            batch_members = []
+        
+        for j, i in enumerate(batch_members):
+            try:
+                flagged = [
+                    (codes[idx], _anomaly_record(batch_expenses[idx], z_score, mean[codes[idx]], std[codes[idx]]))
+                    for idx, z_score in zip(
+                        anomaly_idx[bounds[j]:bounds[j + 1]],
+                        z_scores[bounds[j]:bounds[j + 1]]
+                    )
+                ]
+                # Codes follow first-seen category order, so group by code, then date
+                flagged.sort(key=lambda f: (f[0], f[1]["date"]))
+                results[i] = _anomaly_response([record for _, record in flagged])
+            except Exception as e:
+                results[i] = e
+    
+    logger.info(f"Scored a batch of {len(payloads)} anomaly requests")
+    
+    return results
+
+
+class AnomalyBatcher:
+    """
+    Coalesce concurrent anomaly-detection requests
+    Whatever is queued is dispatched at once; payloads only accumulate while
+    an earlier batch is still running on the worker thread pool, and are then
+    scored together in one NumPy pass and fanned back out per request
+    """
+    
+    def __init__(self, max_size: int = BATCH_MAX_REQUESTS):
+        self.max_size = max_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+    
+    async def submit(self, expenses: List[Transaction]) -> AnomalyResponse:
+        """Queue a payload and wait for its share of the batch result"""
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue()
+            self._collector = asyncio.create_task(self._collect())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((expenses, future))
+        return await future
+    
+    async def close(self) -> None:
+        """Stop collecting; batches already dispatched run to completion"""
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
+    
+    async def _collect(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            
+            while len(batch) < self.max_size:
+                # Drain anything already queued without waiting
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                
+                # Idle service: dispatch immediately rather than wait for company
+                running = [task for task in self._inflight if not task.done()]
+                if not running:
+                    break
+                
+                # Busy service: keep the batch open until new work arrives or
+                # an earlier batch frees up its thread
+                getter = asyncio.ensure_future(self._queue.get())
+                await asyncio.wait([getter, *running], return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    batch.append(getter.result())
+                else:
+                    getter.cancel()
+                    break
+            
+            # Keep collecting the next batch while this one is computed
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+    
+    async def _dispatch(self, batch) -> None:
+        try:
+            results = await anyio.to_thread.run_sync(
+                _compute_anomalies_batch, [expenses for expenses, _ in batch]
+            )
+        except Exception as e:
+            # Only reached if the batch could not be run at all
+            results = [e] * len(batch)
         
-    except Exception as e:
-        logger.error(f"Error predicting expenses: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        # Settle each request on its own outcome
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+anomaly_batcher = AnomalyBatcher()
 
 
 @app.post("/api/ml/detect-anomalies", response_model=AnomalyResponse)
@@ -202,65 +658,78 @@ async def detect_anomalies(data: TransactionData):
         if not data.transactions:
             raise HTTPException(status_code=400, detail="No transaction data provided")
         
-        # Convert to DataFrame
-        df = pd.DataFrame([t.dict() for t in data.transactions])
-        df['date'] = pd.to_datetime(df['date'])
-        df = df[df['type'] == 'expense'].sort_values('date')
+        expenses = data.expenses
         
-        if len(df) < 5:
-            return AnomalyResponse(
+        if len(expenses) < 5:
+            return _to_response(AnomalyResponse(
                 anomalies=[],
                 total_anomalies=0,
                 message="Need at least 5 transactions for anomaly detection"
-            )
+            ))
         
-        # Detect anomalies by category using z-score
-        anomalies = []
+        # Small payloads skip the coalescing window and NumPy entirely
+        if len(expenses) < SMALL_PAYLOAD_THRESHOLD:
+            anomalies = await anyio.to_thread.run_sync(_detect_anomalies_small, expenses)
+            return _to_response(_anomaly_response(anomalies))
         
-        for category in df['category'].unique():
-            category_df = df[df['category'] == category]
-            
-            if len(category_df) < 3:
-                continue
-            
-            amounts = category_df['amount'].values
-            mean = np.mean(amounts)
-            std = np.std(amounts)
-            
-            if std == 0:
-                continue
-            
-            # Z-score threshold of 2 (2 standard deviations)
-            z_scores = np.abs((amounts - mean) / std)
-            
-            for idx, z_score in enumerate(z_scores):
-                if z_score > 2:
-                    transaction = category_df.iloc[idx]
-                    anomalies.append({
-                        "date": transaction['date'].isoformat(),
-                        "amount": float(transaction['amount']),
-                        "category": transaction['category'],
-                        "z_score": float(z_score),
-                        "expected_range": {
-                            "min": float(mean - 2 * std),
-                            "max": float(mean + 2 * std)
-                        },
-                        "severity": "high" if z_score > 3 else "medium"
-                    })
-        
-        logger.info(f"Detected {len(anomalies)} anomalies")
-        
-        return AnomalyResponse(
-            anomalies=anomalies,
-            total_anomalies=len(anomalies),
-            message=f"Detected {len(anomalies)} anomalous transactions"
-        )
+        result = await anomaly_batcher.submit(expenses)
+        return _to_response(result)
         
     except Exception as e:
         logger.error(f"Error detecting anomalies: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _compute_income_forecast(income_txs: List[Transaction]) -> ForecastResponse:
+    """Compute 3-month income forecast from income transactions"""
+    if len(income_txs) < 3:
+        return ForecastResponse(
+            forecast=[],
+            message="Insufficient income data for forecasting. Need at least 3 income transactions."
+        )
+    
+    # Group by month
+    month_keys, incomes = _monthly_series(income_txs)
+    
+    if len(incomes) < 2:
+        return ForecastResponse(
+            forecast=[],
+            message="Need at least 2 months of income data"
+        )
+    
+    # Simple forecasting: average with trend
+    avg_income = fmean(incomes)
+    
+    # Calculate trend (closed-form OLS slope over x = 0..n-1)
+    n_months = len(incomes)
+    x_mean = (n_months - 1) / 2
+    sxx = n_months * (n_months * n_months - 1) / 12.0
+    trend = sum((x - x_mean) * y for x, y in enumerate(incomes)) / sxx
+    
+    # Generate forecast
+    forecast = []
+    last_month = month_keys[-1]
+    
+    for i in range(1, 4):
+        next_month = last_month + i
+        predicted_income = avg_income + (trend * (len(incomes) + i))
+        confidence_margin = avg_income * 0.1  # 10% confidence margin
+        
+        forecast.append({
+            "month": _format_month(next_month),
+            "predicted_income": round(predicted_income, 2),
+            "confidence_lower": round(predicted_income - confidence_margin, 2),
+            "confidence_upper": round(predicted_income + confidence_margin, 2)
+        })
+    
+    logger.info(f"Generated income forecast for {len(forecast)} months")
+    
+    return ForecastResponse(
+        forecast=forecast,
+        message="Income forecast generated successfully"
+    )
+
+
 @app.post("/api/ml/forecast-income", response_model=ForecastResponse)
 async def forecast_income(data: TransactionData):
     """
@@ -271,58 +740,8 @@ async def forecast_income(data: TransactionData):
         if not data.transactions:
             raise HTTPException(status_code=400, detail="No transaction data provided")
         
-        # Convert to DataFrame
-        df = pd.DataFrame([t.dict() for t in data.transactions])
-        df['date'] = pd.to_datetime(df['date'])
-        df = df[df['type'] == 'income'].sort_values('date')
-        
-        if len(df) < 3:
-            return ForecastResponse(
-                forecast=[],
-                message="Insufficient income data for forecasting. Need at least 3 income transactions."
-            )
-        
-        # Group by month
-        df['month'] = df['date'].dt.to_period('M')
-        monthly_income = df.groupby('month')['amount'].sum().reset_index()
-        
-        if len(monthly_income) < 2:
-            return ForecastResponse(
-                forecast=[],
-                message="Need at least 2 months of income data"
-            )
-        
-        # Simple forecasting: average with trend
-        incomes = monthly_income['amount'].values
-        avg_income = np.mean(incomes)
-        
-        # Calculate trend (linear)
-        x = np.arange(len(incomes))
-        z = np.polyfit(x, incomes, 1)
-        trend = z[0]
-        
-        # Generate forecast
-        forecast = []
-        last_month = monthly_income['month'].max()
-        
-        for i in range(1, 4):
-            next_month = last_month + i
-            predicted_income = avg_income + (trend * (len(incomes) + i))
-            confidence_margin = avg_income * 0.1  # 10% confidence margin
-            
-            forecast.append({
-                "month": str(next_month),
-                "predicted_income": round(float(predicted_income), 2),
-                "confidence_lower": round(float(predicted_income - confidence_margin), 2),
-                "confidence_upper": round(float(predicted_income + confidence_margin), 2)
-            })
-        
-        logger.info(f"Generated income forecast for {len(forecast)} months")
-        
-        return ForecastResponse(
-            forecast=forecast,
-            message="Income forecast generated successfully"
-        )
+        result = await anyio.to_thread.run_sync(_compute_income_forecast, data.incomes)
+        return _to_response(result)
         
     except Exception as e:
         logger.error(f"Error forecasting income: {str(e)}")
@@ -331,4 +750,15 @@ async def forecast_income(data: TransactionData):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # One process per usable CPU; workers need the app as an import string,
+    # so point app_dir at ml-service/ in case this file is run as a script
+    uvicorn.run(
+        "app.main:app",
+        app_dir=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        host="0.0.0.0",
+        port=8000,
+        workers=WORKERS,
+        loop="uvloop",
+        http="httptools",
+        log_level="warning"
+    )